@@ -1,8 +1,8 @@
 """
 Class for reading data from a .kwik dataset
 
-Depends on: scipy
-            phy
+Depends on: klusta
+            h5py (optional)
 
 Supported: Read
 
@@ -15,15 +15,6 @@ import numpy as np
 import quantities as pq
 import os
 
-try:
-    from scipy import stats
-except ImportError as err:
-    HAVE_SCIPY = False
-    SCIPY_ERR = err
-else:
-    HAVE_SCIPY = True
-    SCIPY_ERR = None
-
 try:
     from klusta import kwik
 except ImportError as err:
@@ -33,6 +24,15 @@ else:
     HAVE_KWIK = True
     KWIK_ERR = None
 
+try:
+    import h5py
+except ImportError as err:
+    HAVE_H5PY = False
+    H5PY_ERR = err
+else:
+    HAVE_H5PY = True
+    H5PY_ERR = None
+
 # I need to subclass BaseIO
 from neo.io.baseio import BaseIO
 
@@ -41,6 +41,21 @@ from neo.core import Segment, SpikeTrain, Epoch, AnalogSignal, Block, Group
 import neo.io.tools
 
 
+def _memmap_dataset(dset):
+    """
+    Memory-map a contiguous, uncompressed HDF5 dataset, bypassing the
+    libhdf5 read path so channel slicing becomes a pure NumPy stride.
+    Returns None if the dataset layout does not allow it.
+    """
+    if dset.chunks is not None or dset.compression is not None:
+        return None
+    offset = dset.id.get_offset()
+    if offset is None:  # no storage allocated yet
+        return None
+    return np.memmap(dset.file.filename, dtype=dset.dtype, mode='r',
+                     offset=offset, shape=dset.shape)
+
+
 class KwikIO(BaseIO):
     """
     Class for "reading" experimental data from a .kwik file.
@@ -82,8 +97,20 @@ class KwikIO(BaseIO):
         BaseIO.__init__(self)
         self.filename = os.path.abspath(filename)
         model = kwik.KwikModel(self.filename)  # TODO this group is loaded twice
+        channel_groups = model.channel_groups
+        # this model is only needed to enumerate the channel groups;
+        # release its file handle before opening the per-group models
+        model.close()
         self.models = [kwik.KwikModel(self.filename, channel_group=grp)
-                       for grp in model.channel_groups]
+                       for grp in channel_groups]
+
+    def close(self):
+        """
+        Closes the underlying klusta models and their file handles.
+        """
+        for model in self.models:
+            model.close()
+        self.models = []
 
     def read_block(self,
                    lazy=False,
@@ -110,7 +137,11 @@ class KwikIO(BaseIO):
 
         blk = Block()
         seg = Segment(file_origin=self.filename)
-        blk.segments += [seg]
+        blk.segments.append(seg)
+        # collect the data objects locally and attach them to the segment
+        # in one go at the end
+        spiketrains = []
+        analogsignals = []
         for model in self.models:
             group_id = model.channel_group
             group_meta = {'group_id': group_id}
@@ -119,31 +150,52 @@ class KwikIO(BaseIO):
                                index=model.channels,
                                **group_meta)
             blk.groups.append(chx)
+            # resolve the model properties once per channel group rather
+            # than once per cluster
             clusters = model.spike_clusters
-            for cluster_id in model.cluster_ids:
-                meta = model.cluster_metadata[cluster_id]
-                if cluster_group is None:
-                    pass
-                elif cluster_group != meta:
-                    continue
+            spike_times = model.spike_times
+            cluster_metadata = model.cluster_metadata
+            duration = model.duration
+            # locate every cluster's spikes with one stable sort instead
+            # of a full scan of spike_clusters per cluster; the stable
+            # sort keeps each cluster's spikes in time order
+            order = np.argsort(clusters, kind='stable')
+            sorted_clusters = clusters[order]
+            # select the clusters up front so the construction loop below
+            # does no per-iteration filtering
+            clusters_to_load = [(cluster_id, cluster_metadata[cluster_id])
+                                for cluster_id in model.cluster_ids]
+            if cluster_group is not None:
+                clusters_to_load = [(cluster_id, meta)
+                                    for cluster_id, meta in clusters_to_load
+                                    if meta == cluster_group]
+            for cluster_id, meta in clusters_to_load:
+                lo = np.searchsorted(sorted_clusters, cluster_id, side='left')
+                hi = np.searchsorted(sorted_clusters, cluster_id, side='right')
                 sptr = self.read_spiketrain(cluster_id=cluster_id,
+                                            idx=order[lo:hi],
                                             model=model,
                                             get_waveforms=get_waveforms,
-                                            raw_data_units=raw_data_units)
+                                            raw_data_units=raw_data_units,
+                                            clusters=clusters,
+                                            spike_times=spike_times,
+                                            duration=duration)
                 sptr.annotations.update({'cluster_group': meta,
-                                         'group_id': model.channel_group})
+                                         'group_id': group_id})
                 unit = Group(cluster_group=meta,
-                             group_id=model.channel_group,
+                             group_id=group_id,
                              name='unit #{}'.format(cluster_id))
                 unit.add(sptr)
                 chx.add(unit)
-                seg.spiketrains.append(sptr)
+                spiketrains.append(sptr)
             if get_raw_data:
                 ana = self.read_analogsignal(model, units=raw_data_units)
                 chx.add(ana)
-                seg.analogsignals.append(ana)
+                analogsignals.append(ana)
 
-        seg.duration = model.duration * pq.s
+        seg.spiketrains.extend(spiketrains)
+        seg.analogsignals.extend(analogsignals)
+        seg.duration = duration * pq.s
 
         blk.create_many_to_one_relationship()
         return blk
@@ -158,16 +210,38 @@ class KwikIO(BaseIO):
         """
         assert not lazy, 'Do not support lazy'
 
-        arr = model.traces[:] * model.metadata['voltage_gain']
+        metadata = model.metadata
+        traces = model.traces
+        arr = None
+        if HAVE_H5PY and isinstance(traces, h5py.Dataset):
+            arr = _memmap_dataset(traces)
+        if arr is not None:
+            # the memmap is read-only; gain scaling materializes the
+            # float copy in a single fused pass
+            arr = arr * metadata['voltage_gain']
+        elif hasattr(traces, 'read_direct'):
+            # single bulk HDF5 read into a preallocated float buffer, so
+            # libhdf5 converts the raw integer samples while reading and
+            # the gain can be applied in place: no separate upcast pass
+            arr = np.empty(traces.shape, dtype=np.float64)
+            traces.read_direct(arr)
+            arr *= metadata['voltage_gain']
+        else:
+            arr = traces[:] * metadata['voltage_gain']
         ana = AnalogSignal(arr, sampling_rate=model.sample_rate * pq.Hz,
                            units=units,
-                           file_origin=model.metadata['raw_data_files'])
+                           file_origin=metadata['raw_data_files'],
+                           **{'channel_index': model.channels})
         return ana
 
     def read_spiketrain(self, cluster_id, model,
                         lazy=False,
                         get_waveforms=True,
-                        raw_data_units=None
+                        raw_data_units=None,
+                        clusters=None,
+                        spike_times=None,
+                        duration=None,
+                        idx=None
                         ):
         """
         Reads sorted spiketrains
@@ -179,6 +253,18 @@ class KwikIO(BaseIO):
             Which cluster to load, according to cluster id from klusta
         model: klusta.kwik.KwikModel
             A KwikModel object obtained by klusta.kwik.KwikModel(fname)
+        clusters: np.ndarray, default = None
+            Cached model.spike_clusters, to avoid re-resolving it on
+            every call
+        spike_times: np.ndarray, default = None
+            Cached model.spike_times, to avoid re-resolving it on
+            every call
+        duration: float, default = None
+            Cached model.duration, to avoid re-resolving it on
+            every call
+        idx: np.ndarray, default = None
+            Precomputed indices of this cluster's spikes, in time order;
+            computed from clusters when not given
         """
         try:
             if (not (cluster_id in model.cluster_ids)):
@@ -186,8 +272,15 @@ class KwikIO(BaseIO):
         except ValueError:
             print("Exception: cluster_id (%d) not found !! " % cluster_id)
             return
-        clusters = model.spike_clusters
-        idx = np.nonzero(clusters == cluster_id)
+        if spike_times is None:
+            spike_times = model.spike_times
+        if idx is None:
+            if clusters is None:
+                clusters = model.spike_clusters
+            # flat index array, sorted in time order, so that waveform and
+            # spike-time extraction walks the underlying storage
+            # monotonically
+            idx = np.nonzero(clusters == cluster_id)[0]
         if get_waveforms:
             w = model.all_waveforms[idx]
             # klusta: num_spikes, samples_per_spike, num_chans = w.shape
@@ -195,11 +288,18 @@ class KwikIO(BaseIO):
             w = pq.Quantity(w, raw_data_units)
         else:
             w = None
-        if model.duration > 0.:
-            t_stop = model.duration
+        if duration is None:
+            duration = model.duration
+        if duration > 0.:
+            t_stop = duration
         else:
-            t_stop = np.max(model.spike_times[idx])
-        sptr = SpikeTrain(times=model.spike_times[idx],
+            # spike_times is sorted and idx is in time order, so the last
+            # spike is the maximum; no need to materialize the whole
+            # cluster's times just to reduce them
+            t_stop = spike_times[idx[-1]]
+        # the indexed times are already a fresh array, so the SpikeTrain
+        # can take ownership of them instead of copying again
+        sptr = SpikeTrain(times=spike_times[idx], copy=False,
                           t_stop=t_stop, waveforms=w, units='s',
                           sampling_rate=model.sample_rate * pq.Hz,
                           file_origin=self.filename,